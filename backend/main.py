@@ -1,34 +1,99 @@
-from typing import Optional, List
+from typing import Optional, List, AsyncIterator, NamedTuple
 
 from fastapi import FastAPI, Depends, HTTPException, status, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 
-from sqlmodel import SQLModel, Field, Session, create_engine, select
-
-from uuid import uuid4
-import pandas as pd
+from pydantic import ConfigDict
+from sqlmodel import SQLModel, Field, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import Index, bindparam, delete, event, func, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import csv
+import hashlib
+import os
+import secrets
+import numpy as np
 import io
 
 
-DATABASE_URL = "sqlite:///./app.db"
+DATABASE_URL = "sqlite+aiosqlite:///./app.db"
+
+
+def _new_engine(pool_size: int, max_overflow: int):
+    return create_async_engine(
+        DATABASE_URL,
+        echo=False,
+        connect_args={"check_same_thread": False},
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=True,
+    )
+
+
+# wzorzec SQLite: jeden pisarz, wielu czytelników — osobne pule, żeby
+# odczyty nie czekały w kolejce za zapisami
+read_engine = _new_engine(pool_size=os.cpu_count() or 4, max_overflow=10)
+write_engine = _new_engine(pool_size=1, max_overflow=0)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # page_size działa tylko na świeżej bazie (lub po VACUUM), dlatego
+    # przed pierwszym CREATE TABLE; mmap czyta strony bez syscalli pread
+    cursor.execute("PRAGMA page_size=4096")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
 
-engine = create_engine(
-    DATABASE_URL,
-    echo=True,
-)
 
+event.listen(read_engine.sync_engine, "connect", set_sqlite_pragmas)
+event.listen(write_engine.sync_engine, "connect", set_sqlite_pragmas)
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+
+@event.listens_for(write_engine.sync_engine, "connect")
+def _disable_implicit_begin(dbapi_connection, connection_record):
+    # pisarz steruje transakcją sam (BEGIN IMMEDIATE poniżej)
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(write_engine.sync_engine, "begin")
+def _begin_immediate(conn):
+    # blokada zapisu od razu, zamiast eskalacji z odroczonego BEGIN
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+async def create_db_and_tables():
+    async with write_engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+
+async def get_read_session() -> AsyncIterator[AsyncSession]:
+    # bez wygaszania atrybutów po commit — serializacja odpowiedzi nie
+    # wywołuje ponownego SELECT-a
+    async with AsyncSession(read_engine, expire_on_commit=False) as session:
+        yield session
 
 
-def get_session():
-    with Session(engine) as session:
+async def get_write_session() -> AsyncIterator[AsyncSession]:
+    async with AsyncSession(write_engine, expire_on_commit=False) as session:
         yield session
 
 
 
+# Uwaga: modele celowo nie mają Relationship() — przy AsyncSession każdy
+# leniwy dostęp po zamknięciu sesji kończy się błędem, a odpowiedzi i tak
+# budujemy z w pełni załadowanych wierszy. Jeśli kiedyś dojdzie
+# User.todos, musi dostać sa_relationship_kwargs={"lazy": "selectin"}.
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(index=True, unique=True)
@@ -36,18 +101,54 @@ class User(SQLModel, table=True):
 
 
 class Todo(SQLModel, table=True):
+    # złożone indeksy: /stats liczy się z samego ix_todo_user_done,
+    # a listowanie/eksport idzie po ix_todo_user_id_id
+    __table_args__ = (
+        Index("ix_todo_user_done", "user_id", "done"),
+        Index("ix_todo_user_id_id", "user_id", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
     done: bool = Field(default=False)
-    user_id: int = Field(index=True)
+    user_id: int
+
+
+
+class CurrentUser(NamedTuple):
+    id: int
+    username: str
+
+
+# skompilowane raz na starcie — bez budowania SQL przy każdym żądaniu
+_USER_BY_KEY = select(User.id, User.username).where(
+    User.api_key == bindparam("k")
+)
 
 
+def _hash_api_key(api_key: str) -> str:
+    # w bazie trzymamy tylko sha256 klucza — wyciek bazy nie wycieka kluczy
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+# api_key -> CurrentUser; klucze są niezmienne, więc wpisy nigdy nie gasną.
+# Przy przepełnieniu wypada najstarszy wpis (kolejność wstawiania dicta).
+_USER_CACHE_MAX = 2048
+_user_cache: dict = {}
+
+
+def _cache_user(api_key: str, user: CurrentUser) -> None:
+    if len(_user_cache) >= _USER_CACHE_MAX:
+        _user_cache.pop(next(iter(_user_cache)))
+    _user_cache[api_key] = user
+
 
 class RegisterRequest(SQLModel):
     username: str
 
 
 class UserPublic(SQLModel):
+    model_config = ConfigDict(from_attributes=True)
+
     username: str
     api_key: str
 
@@ -61,6 +162,14 @@ class TodoUpdate(SQLModel):
     done: Optional[bool] = None
 
 
+class StatsOut(SQLModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    total: int
+    done: int
+    not_done: int
+
+
 app = FastAPI(title="Todo API")
 
 # pozwolenie frontendowi łączyć się z API
@@ -79,16 +188,16 @@ app.add_middleware(
 
 
 @app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+async def on_startup():
+    await create_db_and_tables()
 
 
 
 
-def get_current_user(
+async def get_current_user(
     x_api_key: Optional[str] = Header(None, alias="X-API-Key"),
-    session: Session = Depends(get_session),
-) -> User:
+    session: AsyncSession = Depends(get_read_session),
+) -> CurrentUser:
 
     if not x_api_key:
         raise HTTPException(
@@ -96,170 +205,237 @@ def get_current_user(
             detail="Missing API key",
         )
 
-    user = session.exec(
-        select(User).where(User.api_key == x_api_key)
-    ).first()
+    cached = _user_cache.get(x_api_key)
+    if cached is not None:
+        return cached
 
-    if not user:
+    row = (await session.exec(
+        _USER_BY_KEY, params={"k": _hash_api_key(x_api_key)}
+    )).first()
+
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API key",
         )
 
+    user = CurrentUser(id=row.id, username=row.username)
+    _cache_user(x_api_key, user)
     return user
 
 
 @app.post("/register", response_model=UserPublic)
-def register(
+async def register(
     payload: RegisterRequest,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_write_session),
 ):
-    existing = session.exec(
-        select(User).where(User.username == payload.username)
-    ).first()
-
-    if existing:
-
-        return UserPublic(username=existing.username, api_key=existing.api_key)
-
-    api_key = uuid4().hex
-    user = User(username=payload.username, api_key=api_key)
-    session.add(user)
-    session.commit()
-    session.refresh(user)
+    # bez wstępnego SELECT-a — unikalność pilnuje baza, co usuwa wyścig
+    # między sprawdzeniem a wstawieniem
+    api_key = secrets.token_urlsafe(24)
+    try:
+        await session.exec(
+            insert(User).values(
+                username=payload.username,
+                api_key=_hash_api_key(api_key),
+            )
+        )
+        await session.commit()
+    except IntegrityError:
+        # w bazie jest tylko hash, więc istniejącego klucza nie da się
+        # odtworzyć i powtórna rejestracja musi być błędem
+        await session.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already registered",
+        )
 
-    return UserPublic(username=user.username, api_key=user.api_key)
+    return UserPublic(username=payload.username, api_key=api_key)
 
 
 @app.get("/todos", response_model=List[Todo])
-def list_todos(
-    current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+async def list_todos(
+    current_user: CurrentUser = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
 ):
     """
     Zwraca listę zadań zalogowanego użytkownika.
     """
-    todos = session.exec(
-        select(Todo).where(Todo.user_id == current_user.id)
-    ).all()
-    return todos
+    # yield_per: sterownik dociąga wiersze paczkami zamiast buforować
+    # cały wynik po stronie kursora
+    result = await session.stream(
+        select(Todo)
+        .where(Todo.user_id == current_user.id)
+        .execution_options(yield_per=500)
+    )
+    return [todo async for todo in result.scalars()]
 
 
 @app.post("/todos", response_model=Todo, status_code=201)
-def create_todo(
+async def create_todo(
     payload: TodoCreate,
-    current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    current_user: CurrentUser = Depends(get_current_user),
+    session: AsyncSession = Depends(get_write_session),
 ):
-    todo = Todo(
-        title=payload.title,
-        user_id=current_user.id,
-    )
-    session.add(todo)
-    session.commit()
-    session.refresh(todo)
-    return todo
+    # INSERT ... RETURNING — nowy wiersz w jednej instrukcji, bez ORM
+    row = (await session.exec(
+        insert(Todo)
+        .values(title=payload.title, user_id=current_user.id, done=False)
+        .returning(Todo.id, Todo.title, Todo.done, Todo.user_id)
+    )).one()
+    await session.commit()
+    return Todo(id=row.id, title=row.title, done=row.done, user_id=row.user_id)
 
 
 @app.put("/todos/{todo_id}", response_model=Todo)
-def update_todo(
+async def update_todo(
     todo_id: int,
     payload: TodoUpdate,
-    current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    current_user: CurrentUser = Depends(get_current_user),
+    session: AsyncSession = Depends(get_write_session),
 ):
-    todo = session.get(Todo, todo_id)
-    if not todo or todo.user_id != current_user.id:
-        raise HTTPException(404, "Todo not found")
-
+    values = {}
     if payload.title is not None:
-        todo.title = payload.title
+        values["title"] = payload.title
     if payload.done is not None:
-        todo.done = payload.done
+        values["done"] = payload.done
+
+    if not values:
+        # nic do zmiany — tylko odczyt z kontrolą właściciela
+        todo = (await session.exec(
+            select(Todo).where(
+                Todo.id == todo_id, Todo.user_id == current_user.id
+            )
+        )).first()
+        if not todo:
+            raise HTTPException(404, "Todo not found")
+        return todo
+
+    # jeden UPDATE z warunkiem właściciela zamiast SELECT + UPDATE
+    row = (await session.exec(
+        update(Todo)
+        .where(Todo.id == todo_id, Todo.user_id == current_user.id)
+        .values(**values)
+        .returning(Todo.id, Todo.title, Todo.done, Todo.user_id)
+    )).first()
+    await session.commit()
+
+    if not row:
+        raise HTTPException(404, "Todo not found")
 
-    session.add(todo)
-    session.commit()
-    session.refresh(todo)
-    return todo
+    return Todo(id=row.id, title=row.title, done=row.done, user_id=row.user_id)
 
 
 @app.delete("/todos/{todo_id}", status_code=204)
-def delete_todo(
+async def delete_todo(
     todo_id: int,
-    current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    current_user: CurrentUser = Depends(get_current_user),
+    session: AsyncSession = Depends(get_write_session),
 ):
-    todo = session.get(Todo, todo_id)
-    if not todo or todo.user_id != current_user.id:
-        raise HTTPException(404, "Todo not found")
+    result = await session.exec(
+        delete(Todo).where(
+            Todo.id == todo_id, Todo.user_id == current_user.id
+        )
+    )
+    await session.commit()
 
-    session.delete(todo)
-    session.commit()
+    if result.rowcount == 0:
+        raise HTTPException(404, "Todo not found")
     return
 
 
 
 
+async def _compute_stats_for_user(current_user: CurrentUser, session: AsyncSession):
+    flags = (await session.exec(
+        select(Todo.done).where(Todo.user_id == current_user.id)
+    )).all()
 
-def _compute_stats_for_user(current_user: User, session: Session):
-    todos = session.exec(
-        select(Todo).where(Todo.user_id == current_user.id)
-    ).all()
-
-    if not todos:
-        return {"total": 0, "done": 0, "not_done": 0}
+    # jedna kolumnowa tablica zamiast DataFrame z listy słowników —
+    # pandas musiałby zgadywać kolumny i dtype dla każdego wiersza
+    done_arr = np.fromiter(flags, dtype=np.bool_, count=len(flags))
 
-    df = pd.DataFrame(
-        [{"id": t.id, "done": t.done} for t in todos]
-    )
-
-    total = len(df)
-    done = int(df["done"].sum())  # True/False zsumowane jako liczba
+    total = int(done_arr.size)
+    done = int(done_arr.sum())  # True/False zsumowane jako liczba
     not_done = total - done
 
     return {"total": total, "done": done, "not_done": not_done}
 
 
-@app.get("/stats")
-def stats(
-    current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+@app.get("/stats", response_model=StatsOut)
+async def stats(
+    current_user: CurrentUser = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
 ):
-    return _compute_stats_for_user(current_user, session)
+    # agregacja w bazie — dwie liczby zamiast wszystkich wierszy
+    total, done = (await session.exec(
+        select(
+            func.count(Todo.id),
+            func.coalesce(func.sum(Todo.done), 0),
+        ).where(Todo.user_id == current_user.id)
+    )).one()
+
+    return {"total": total, "done": int(done), "not_done": total - int(done)}
 
 
-@app.get("/stats-pandas")
-def stats_pandas(
-    current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+@app.get("/stats-pandas", response_model=StatsOut)
+async def stats_pandas(
+    current_user: CurrentUser = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
 ):
-    return _compute_stats_for_user(current_user, session)
+    return await _compute_stats_for_user(current_user, session)
 
 
-@app.get("/todos/export")
-def export_todos_csv(
-    current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
-):
-    todos = session.exec(
-        select(Todo).where(Todo.user_id == current_user.id)
-    ).all()
+_CSV_CHUNK = 1000
 
-    if todos:
-        df = pd.DataFrame(
-            [{"id": t.id, "title": t.title, "done": t.done} for t in todos]
-        )
-    else:
-        df = pd.DataFrame(columns=["id", "title", "done"])
 
+def _csv_lines(rows):
     buffer = io.StringIO()
-    df.to_csv(buffer, index=False)
-    buffer.seek(0)
+    writer = csv.writer(buffer)
+
+    writer.writerow(["id", "title", "done"])
+    yield buffer.getvalue()
+
+    # writerows paczkami — jeden chunk odpowiedzi na _CSV_CHUNK wierszy
+    # zamiast osobnego wysłania każdej linii
+    for start in range(0, len(rows), _CSV_CHUNK):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows[start:start + _CSV_CHUNK])
+        yield buffer.getvalue()
+
+
+@app.get("/todos/export")
+async def export_todos_csv(
+    current_user: CurrentUser = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
+):
+    # wąskie krotki zamiast obiektów ORM; wiersze CSV formatowane leniwie
+    result = await session.stream(
+        select(Todo.id, Todo.title, Todo.done)
+        .where(Todo.user_id == current_user.id)
+        .execution_options(yield_per=500)
+    )
+    rows = [row async for row in result]
 
     return StreamingResponse(
-        buffer,
+        _csv_lines(rows),
         media_type="text/csv",
         headers={
             "Content-Disposition": 'attachment; filename="todos.csv"'
         },
     )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # produkcyjne uruchomienie: pętla uvloop + parser httptools,
+    # po jednym workerze na rdzeń (uvloop wymaga platformy innej niż Windows)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=os.cpu_count(),
+        loop="uvloop",
+        http="httptools",
+    )
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 
@@ -7,36 +8,42 @@ if BASE_DIR not in sys.path:
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.pool import StaticPool
 
-from main import app, get_session, User, Todo
+from main import app, get_read_session, get_write_session, User, Todo, _user_cache
 
 
-TEST_DATABASE_URL = "sqlite://"
+TEST_DATABASE_URL = "sqlite+aiosqlite://"
 
-test_engine = create_engine(
+test_engine = create_async_engine(
     TEST_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
 
 
-def override_get_session():
-    with Session(test_engine) as session:
+async def override_get_session():
+    async with AsyncSession(test_engine, expire_on_commit=False) as session:
         yield session
 
 
-app.dependency_overrides[get_session] = override_get_session
+app.dependency_overrides[get_read_session] = override_get_session
+app.dependency_overrides[get_write_session] = override_get_session
+
+
+async def _reset_db():
+    async with test_engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+        await conn.run_sync(SQLModel.metadata.create_all)
 
 
 @pytest.fixture(scope="function")
 def client():
-    SQLModel.metadata.drop_all(test_engine)
-    SQLModel.metadata.create_all(test_engine)
-
-    User.__table__.create(test_engine, checkfirst=True)
-    Todo.__table__.create(test_engine, checkfirst=True)
+    asyncio.run(_reset_db())
+    _user_cache.clear()
 
     with TestClient(app) as c:
-        yield c
\ No newline at end of file
+        yield c